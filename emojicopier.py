@@ -1,15 +1,18 @@
+import asyncio
+import hashlib
+import json
 import os
 import random
 import re
-import tomllib
+import string
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from enum import Enum
 from io import BytesIO
 from logging import getLogger
-from math import ceil, sqrt
-from tempfile import TemporaryFile
-from typing import Sequence, cast
-from urllib.parse import urlparse
+from math import sqrt
+from typing import Awaitable, Callable, Sequence, cast
 from zipfile import ZipFile
 
 from discord import (
@@ -18,10 +21,12 @@ from discord import (
     ButtonStyle,
     Client,
     Color,
+    DiscordServerError,
     Embed,
     Emoji,
     File,
     Guild,
+    GuildPreview,
     GuildSticker,
     HTTPException,
     Intents,
@@ -33,6 +38,8 @@ from discord import (
     Permissions,
     Role,
     SelectOption,
+    StickerFormatType,
+    StickerItem,
     User,
 )
 from discord.app_commands import (
@@ -44,11 +51,9 @@ from discord.app_commands import (
     ContextMenu,
 )
 from discord.ui import Button, Select, UserSelect, View, button, select
-from PIL import Image
 from yarl import URL
-from zxcvbn import zxcvbn
 
-Expression = Emoji | PartialEmoji | GuildSticker
+Expression = Emoji | PartialEmoji | GuildSticker | StickerItem
 
 password_strengths = (
     ("Terrible", Color.brand_red()),
@@ -58,6 +63,37 @@ password_strengths = (
     ("Excellent", Color.brand_green()),
 )
 
+CREATE_EXPRESSIONS_BIT = Permissions(create_expressions=True).value
+
+MAX_CONCURRENT_COPIES = 10
+# Shared by every copy in progress, so concurrent copies from different users
+# can't add up to a burst that trips Discord's global rate limit.
+rest_write_semaphore = asyncio.Semaphore(20)
+FETCH_CACHE_TTL = 300
+ELEGIBLE_GUILDS_CACHE_TTL = 30
+CACHE_SIZE = 1024
+SYNCED_HASH_PATH = ".synced_hash"
+# discord.py already retries these (and 429s) itself before raising.
+RETRIED_BY_LIBRARY = {500, 502, 504, 524}
+
+EMOJI_NAME_CHARACTERS = frozenset(string.ascii_letters + string.digits + "_")
+EMOJI_NAME_TRANSLATION = str.maketrans(
+    {chr(c): "_" for c in range(128) if chr(c) not in EMOJI_NAME_CHARACTERS}
+)
+
+
+class UncopyableError(Exception):
+    pass
+
+
+CopyFailure = HTTPException | UncopyableError
+
+
+def describe_failure(error: CopyFailure) -> str:
+    if isinstance(error, HTTPException):
+        return f"{error.text} ({error.code})"
+    return str(error)
+
 
 class ExpressionLocation(Enum):
     MESSAGE = None
@@ -67,6 +103,48 @@ class ExpressionLocation(Enum):
     BIO = "Bio"
 
 
+async def with_retry[R](
+    request: Callable[[], Awaitable[R]], *, max_attempts: int = 3
+) -> R:
+    for attempt in range(max_attempts - 1):
+        try:
+            return await request()
+        except DiscordServerError as e:
+            if e.status in RETRIED_BY_LIBRARY:
+                raise
+            await asyncio.sleep(min(2**attempt + random.random(), 30))
+    return await request()
+
+
+class TTLCache[K, V]:
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        if (entry := self._entries.get(key)) is None:
+            return None
+        timestamp, value = entry
+        if time.monotonic() - timestamp >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: K):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
 class BaseSelect[T](Select):
     def __init__(self, **kwargs):
         self.selected: list[tuple[T, ExpressionLocation]] = []
@@ -75,29 +153,27 @@ class BaseSelect[T](Select):
 
 class ExpressionSelect(BaseSelect[Expression]):
     def __init__(
-        self, *, expressions: Sequence[tuple[Expression, ExpressionLocation]], **kwargs
+        self,
+        *,
+        expressions: dict[int, tuple[Expression, ExpressionLocation]],
+        **kwargs,
     ):
+        self._expressions = expressions
         super().__init__(
             options=[
                 SelectOption(
                     label=f":{expression.name}:",
                     emoji=(
-                        expression
-                        if isinstance(expression, (Emoji, PartialEmoji))
-                        else None
+                        None if location == ExpressionLocation.STICKER else expression
                     ),
                     description=location.value,
                     value=str(expression.id),
                 )
-                for expression, location in expressions
+                for expression, location in expressions.values()
             ],
             max_values=min(25, len(expressions)),
             **kwargs,
         )
-        self._expressions = {
-            expression.id: (expression, location)
-            for expression, location in expressions
-        }
 
     async def callback(self, interaction: Interaction):
         self.selected = [self._expressions[int(id)] for id in self.values]
@@ -106,12 +182,15 @@ class ExpressionSelect(BaseSelect[Expression]):
 
 class AttachmentSelect(BaseSelect[Attachment]):
     def __init__(self, attachments: Sequence[Attachment], **kwargs):
-        self._attachments = {attachment.id: attachment for attachment in attachments}
-        super().__init__(
-            options=[
+        self._attachments: dict[int, Attachment] = {}
+        options = []
+        for attachment in attachments:
+            self._attachments[attachment.id] = attachment
+            options.append(
                 SelectOption(label=attachment.filename, value=str(attachment.id))
-                for attachment in attachments
-            ],
+            )
+        super().__init__(
+            options=options,
             max_values=len(attachments),
             **kwargs,
         )
@@ -126,20 +205,24 @@ class AttachmentSelect(BaseSelect[Attachment]):
 
 class GuildSelect(Select):
     def __init__(self, *, guilds: list[Guild], **kwargs):
-        super().__init__(
-            options=[
+        self._guilds: dict[int, Guild] = {}
+        options = []
+        for guild in guilds:
+            self._guilds[guild.id] = guild
+            emojis = guild.emojis
+            options.append(
                 SelectOption(
                     label=guild.name,
                     description=guild.description,
-                    emoji=random.choice(guild.emojis) if len(guild.emojis) else None,
+                    emoji=emojis[0] if emojis else None,
                     value=str(guild.id),
                 )
-                for guild in guilds
-            ],
+            )
+        super().__init__(
+            options=options,
             max_values=min(25, len(guilds)),
             **kwargs,
         )
-        self._guilds = {guild.id: guild for guild in guilds}
         self.selected: list[Guild] = []
 
     async def callback(self, interaction: Interaction):
@@ -160,11 +243,19 @@ class BaseCopyView[T](View, ABC):
         self.add_item(self.guild_select)
 
     @abstractmethod
-    async def copy_sticker(self, item: T, guild: Guild, username: str) -> None:
+    async def read_item(self, item: T) -> bytes:
         raise NotImplementedError()
 
     @abstractmethod
-    async def copy_emoji(self, item: T, guild: Guild, username: str) -> None:
+    async def copy_sticker(
+        self, item: T, data: bytes, guild: Guild, username: str
+    ) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def copy_emoji(
+        self, item: T, data: bytes, guild: Guild, username: str
+    ) -> None:
         raise NotImplementedError()
 
     @abstractmethod
@@ -174,28 +265,84 @@ class BaseCopyView[T](View, ABC):
     @button(label="Copy", style=ButtonStyle.primary, row=2)
     async def on_copy(self, interaction: Interaction, button: Button):
         self.stop()
-        await interaction.response.defer()
-        await (await interaction.original_response()).edit(
+        # Acknowledges the button press and shows progress in a single request.
+        await interaction.response.edit_message(
             embed=Embed(color=Color.brand_green(), title="Copying expressions"),
             view=None,
         )
-        succeeded: list[tuple[T, Guild]] = []
-        failed: list[tuple[T, Guild, HTTPException]] = []
-        for guild in self.guild_select.selected:
-            for item, location in self.item_select.selected:
-                try:
-                    if location == ExpressionLocation.STICKER:
-                        await self.copy_sticker(item, guild, interaction.user.name)
-                    else:
-                        await self.copy_emoji(item, guild, interaction.user.name)
-                except HTTPException as e:
-                    self.logger.warning(
-                        f"Failed to copy {item} to {guild}", exc_info=True
-                    )
-                    failed.append((item, guild, e))
+
+        async def read_one(item: T) -> bytes | CopyFailure:
+            try:
+                return await self.read_item(item)
+            except (HTTPException, UncopyableError) as e:
+                self.logger.warning(f"Failed to download {item}", exc_info=True)
+                return e
+
+        # Download each item once up front rather than once per target guild.
+        payloads = (
+            await asyncio.gather(
+                *(read_one(item) for item, _ in self.item_select.selected)
+            )
+            if self.guild_select.selected
+            else []
+        )
+        pairs = [
+            (item, location, data, guild)
+            for guild in self.guild_select.selected
+            for (item, location), data in zip(self.item_select.selected, payloads)
+        ]
+        # Each guild has its own rate limit buckets, so copy to different guilds
+        # concurrently but only one item at a time within a guild.
+        guild_semaphores = {
+            guild.id: asyncio.Semaphore(1) for guild in self.guild_select.selected
+        }
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_COPIES)
+
+        async def upload(
+            item: T, location: ExpressionLocation, data: bytes, guild: Guild
+        ):
+            async with (
+                guild_semaphores[guild.id],
+                semaphore,
+                rest_write_semaphore,
+            ):
+                if location == ExpressionLocation.STICKER:
+                    await self.copy_sticker(item, data, guild, interaction.user.name)
                 else:
-                    self.logger.info(f"Copied {item} to {guild}")
-                    succeeded.append((item, guild))
+                    await self.copy_emoji(item, data, guild, interaction.user.name)
+
+        async def copy_one(
+            item: T,
+            location: ExpressionLocation,
+            data: bytes | CopyFailure,
+            guild: Guild,
+        ) -> CopyFailure | None:
+            if not isinstance(data, bytes):
+                return data
+            try:
+                # The semaphores are taken per attempt, so retry backoff doesn't
+                # hold a slot that other copies could be using.
+                await with_retry(lambda: upload(item, location, data, guild))
+            except HTTPException as e:
+                self.logger.warning(f"Failed to copy {item} to {guild}", exc_info=True)
+                return e
+            else:
+                self.logger.info(f"Copied {item} to {guild}")
+                return None
+
+        results = await asyncio.gather(
+            *(
+                copy_one(item, location, data, guild)
+                for item, location, data, guild in pairs
+            )
+        )
+        succeeded: list[tuple[T, Guild]] = []
+        failed: list[tuple[T, Guild, CopyFailure]] = []
+        for (item, _, _, guild), error in zip(pairs, results):
+            if error is None:
+                succeeded.append((item, guild))
+            else:
+                failed.append((item, guild, error))
         embeds = []
         if len(succeeded):
             embeds.append(
@@ -205,14 +352,17 @@ class BaseCopyView[T](View, ABC):
                 )
             )
         if len(failed):
+            names = await asyncio.gather(
+                *(self.item_name(expression) for expression, _, _ in failed)
+            )
             embeds.append(
                 Embed(
                     color=Color.brand_red(),
                     title=f"Failed to copy {len(failed)} {"expressions" if len(failed) != 1 else "expression"}",
                     description="\n".join(
                         [
-                            f"- {await self.item_name(expression)} to {guild.name}: {error.text} ({error.code})"
-                            for expression, guild, error in failed
+                            f"- {name} to {guild.name}: {describe_failure(error)}"
+                            for name, (_, guild, error) in zip(names, failed)
                         ]
                     ),
                 )
@@ -224,14 +374,14 @@ class BaseCopyView[T](View, ABC):
                     title="Please select some expressions and servers.",
                 )
             )
-        await (await interaction.original_response()).edit(embeds=embeds)
+        await interaction.edit_original_response(embeds=embeds)
 
 
 class CopyExpressionsView(BaseCopyView[Expression]):
     def __init__(
         self,
         client: Client,
-        expressions: Sequence[tuple[Expression, ExpressionLocation]],
+        expressions: dict[int, tuple[Expression, ExpressionLocation]],
         guilds: list[Guild],
     ):
         super().__init__(
@@ -241,26 +391,44 @@ class CopyExpressionsView(BaseCopyView[Expression]):
             ),
             guilds,
         )
-
-    async def copy_sticker(self, item, guild, username):
-        assert isinstance(item, GuildSticker)
+        self._stickers: dict[int, GuildSticker] = {}
+
+    async def read_item(self, item):
+        if isinstance(item, StickerItem):
+            # Message stickers don't carry the description and emoji needed to
+            # recreate them, so fetch the full sticker alongside its image.
+            sticker, data = await asyncio.gather(item.fetch(), item.read())
+            if not isinstance(sticker, GuildSticker):
+                raise UncopyableError("Only server stickers can be copied")
+            self._stickers[item.id] = sticker
+            return data
+        return await item.read()
+
+    async def copy_sticker(self, item, data, guild, username):
+        sticker = self._stickers.get(item.id, item)
+        assert isinstance(sticker, GuildSticker)
+        # Files are consumed when uploaded, so each guild needs a fresh one.
         await guild.create_sticker(
-            name=item.name,
-            description=item.description,
-            emoji=item.emoji,
-            file=await item.to_file(),
+            name=sticker.name,
+            description=sticker.description,
+            emoji=sticker.emoji,
+            file=File(BytesIO(data), filename=URL(sticker.url).name),
             reason=f"Copying sticker (requested by @{username})",
         )
 
-    async def copy_emoji(self, item, guild, username):
+    async def copy_emoji(self, item, data, guild, username):
         await guild.create_custom_emoji(
             name=item.name,
-            image=await item.read(),
+            image=data,
             reason=f"Copying emoji (requested by @{username})",
         )
 
     async def item_name(self, item):
-        return item.name if isinstance(item, GuildSticker) else f":{item.name}:"
+        return (
+            item.name
+            if isinstance(item, (GuildSticker, StickerItem))
+            else f":{item.name}:"
+        )
 
 
 class CopyAttachmentsView(BaseCopyView[Attachment]):
@@ -275,46 +443,72 @@ class CopyAttachmentsView(BaseCopyView[Attachment]):
             guilds,
         )
 
-    async def copy_sticker(self, item: Attachment, guild: Guild, username: str) -> None:
+    async def copy_sticker(
+        self, item: Attachment, data: bytes, guild: Guild, username: str
+    ) -> None:
         raise Exception("Attachments should never be uploaded as stickers!")
 
     def _resize_image(
         self, image_bytes: bytes, format: str | None, target_size: int
     ) -> bytes:
-        # Estimate area ratio = file size ratio. If that wasn't enough, keep trying
-        # until it is.
+        if len(image_bytes) <= target_size:
+            return image_bytes
+        # Pillow is only needed for oversized attachments, so import it lazily.
+        from PIL import Image
+
+        image = Image.open(BytesIO(image_bytes))
+        # The dimensions that produced image_bytes. Draft decoding below can make
+        # the decoded image smaller than this, so estimates must use these.
+        width, height = image.size
+        if image.format == "JPEG":
+            # Let libjpeg decode at a reduced scale (1/2 to 1/8) up front, as
+            # long as the result is still at least as big as the first estimate.
+            scale_factor = sqrt(len(image_bytes) / target_size)
+            image.draft("RGB", (int(width / scale_factor), int(height / scale_factor)))
+        image.load()
+        # Estimate area ratio = file size ratio. If that wasn't enough, keep
+        # shrinking the already decoded image until it is.
         while len(image_bytes) > target_size:
-            image = Image.open(BytesIO(image_bytes))
             scale_factor = sqrt(len(image_bytes) / target_size)
-            image = image.reduce(ceil(scale_factor))
-
-            # thanks pillow
-            with TemporaryFile() as temp:
-                image.save(temp, format)
-                temp.seek(0)
-                image_bytes = temp.read()
+            image.thumbnail(
+                (
+                    max(1, int(width / scale_factor)),
+                    max(1, int(height / scale_factor)),
+                ),
+                Image.Resampling.LANCZOS,
+            )
+            width, height = image.size
+            buffer = BytesIO()
+            image.save(buffer, format, optimize=True)
+            image_bytes = buffer.getvalue()
 
         return image_bytes
 
-    async def copy_emoji(self, item, guild, username):
+    async def read_item(self, item):
+        # Pillow holds the event loop for the whole decode/encode otherwise.
+        return await asyncio.to_thread(
+            self._resize_image,
+            await item.read(),
+            None if item.content_type is None else item.content_type.split("/")[-1],
+            256000,
+        )
+
+    async def copy_emoji(self, item, data, guild, username):
         name = item.filename
         if (idx := name.rfind(".")) > 0:
             name = name[:idx]
-        name = re.sub(r"\W", "_", name)
+        if name.isascii():
+            name = name.translate(EMOJI_NAME_TRANSLATION)
+        else:
+            name = re.sub(r"\W", "_", name)
         if len(name) < 2:
             name = "_" + name
         elif len(name) > 32:
             name = name[:32]
 
-        image_bytes = self._resize_image(
-            await item.read(),
-            None if item.content_type is None else item.content_type.split("/")[-1],
-            256000,
-        )
-
         await guild.create_custom_emoji(
             name=name,
-            image=image_bytes,
+            image=data,
             reason=f"Uploading emoji (requested by @{username})",
         )
 
@@ -358,23 +552,54 @@ class ErrorHandlingCommandTree(CommandTree):
     async def on_error(
         self, interaction: Interaction[Client], error: AppCommandError
     ) -> None:
-        await interaction.response.send_message(
-            embed=Embed(
-                color=Color.brand_red(),
-                title="Catastrophic failure",
-                description="An error occured inside Ideograbber. Whoops!",
-            ),
-            ephemeral=True,
+        embed = Embed(
+            color=Color.brand_red(),
+            title="Catastrophic failure",
+            description="An error occured inside Ideograbber. Whoops!",
         )
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=embed, ephemeral=True)
+        else:
+            await interaction.response.send_message(embed=embed, ephemeral=True)
         return await super().on_error(interaction, error)
 
 
 VALID_ATTACHMENT_TYPES = {"image/gif", "image/jpeg", "image/png"}
 
+ALL_CONTEXTS = AppCommandContext(guild=True, dm_channel=True, private_channel=True)
+GUILD_CONTEXTS = AppCommandContext(guild=True, dm_channel=False, private_channel=False)
+ALL_INSTALLS = AppInstallationType(guild=True, user=True)
+
 
 class EmojiCopier(Client):
-    EMOJI_REGEX = re.compile(r"<(?P<anim>a)?:(?P<name>\w{2,}):(?P<id>\d+)>")
+    EMOJI_REGEX = re.compile(r"<(a)?:(\w{2,}):(\d+)>")
     permissions = Permissions(create_expressions=True)
+    # (name, callback method)
+    CONTEXT_MENUS = (
+        ("Extract expressions", "extract_expressions"),
+        ("Copy expressions", "copy_expressions"),
+        ("Upload attachments as emoji", "copy_attachments"),
+        ("Check password strength", "check_password_strength"),
+        ("Extract user assets", "extract_user_assets"),
+    )
+    # (name, description, callback method, allowed contexts)
+    COMMANDS = (
+        (
+            "server-assets",
+            "Extract server branding assets",
+            "extract_server_assets",
+            GUILD_CONTEXTS,
+        ),
+        ("role-icon", "Extract role icon", "extract_role_icon", GUILD_CONTEXTS),
+        ("dump-avatars", "Batch-download user avatars", "dump_avatars", ALL_CONTEXTS),
+        ("install", "Share a link to install Ideograbber!", "install", ALL_CONTEXTS),
+        # (
+        #     "copy",
+        #     "Copy expressions from this server",
+        #     "copy_server_expressions",
+        #     GUILD_CONTEXTS,
+        # ),
+    )
 
     def __init__(self):
         intents = Intents.default()
@@ -382,127 +607,71 @@ class EmojiCopier(Client):
         super().__init__(intents=intents)
 
         self.tree = ErrorHandlingCommandTree(self)
-
-        self.tree.add_command(
-            ContextMenu(
-                name="Extract expressions",
-                callback=self.extract_expressions,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=True, private_channel=True
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
-            )
-        )
-        self.tree.add_command(
-            ContextMenu(
-                name="Copy expressions",
-                callback=self.copy_expressions,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=True, private_channel=True
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
-            )
-        )
-        self.tree.add_command(
-            ContextMenu(
-                name="Upload attachments as emoji",
-                callback=self.copy_attachments,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=True, private_channel=True
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
-            )
-        )
-        self.tree.add_command(
-            ContextMenu(
-                name="Check password strength",
-                callback=self.check_password_strength,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=True, private_channel=True
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
-            )
+        self.user_cache: TTLCache[int, User] = TTLCache(FETCH_CACHE_TTL, CACHE_SIZE)
+        self.guild_preview_cache: TTLCache[int, GuildPreview] = TTLCache(
+            FETCH_CACHE_TTL, CACHE_SIZE
         )
-
-        self.tree.add_command(
-            ContextMenu(
-                name="Extract user assets",
-                callback=self.extract_user_assets,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=True, private_channel=True
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
-            )
+        self.elegible_guilds_cache: TTLCache[int, list[int]] = TTLCache(
+            ELEGIBLE_GUILDS_CACHE_TTL, CACHE_SIZE
         )
 
-        self.tree.add_command(
-            Command(
-                name="server-assets",
-                description="Extract server branding assets",
-                callback=self.extract_server_assets,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=False, private_channel=False
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
-            )
-        )
-        self.tree.add_command(
-            Command(
-                name="role-icon",
-                description="Extract role icon",
-                callback=self.extract_role_icon,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=False, private_channel=False
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
-            )
-        )
-        self.tree.add_command(
-            Command(
-                name="dump-avatars",
-                description="Batch-download user avatars",
-                callback=self.dump_avatars,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=True, private_channel=True
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
+        for name, callback in self.CONTEXT_MENUS:
+            self.tree.add_command(
+                ContextMenu(
+                    name=name,
+                    callback=getattr(self, callback),
+                    allowed_contexts=ALL_CONTEXTS,
+                    allowed_installs=ALL_INSTALLS,
+                )
             )
-        )
-        self.tree.add_command(
-            Command(
-                name="install",
-                description="Share a link to install Ideograbber!",
-                callback=self.install,
-                allowed_contexts=AppCommandContext(
-                    guild=True, dm_channel=True, private_channel=True
-                ),
-                allowed_installs=AppInstallationType(guild=True, user=True),
+        for name, description, callback, contexts in self.COMMANDS:
+            self.tree.add_command(
+                Command(
+                    name=name,
+                    description=description,
+                    callback=getattr(self, callback),
+                    allowed_contexts=contexts,
+                    allowed_installs=ALL_INSTALLS,
+                )
             )
-        )
-        # self.tree.add_command(
-        #     Command(
-        #         name="copy",
-        #         description="Copy expressions from this server",
-        #         callback=self.copy_server_expressions,
-        #         allowed_contexts=AppCommandContext(
-        #             guild=True, dm_channel=False, private_channel=False
-        #         ),
-        #         allowed_installs=AppInstallationType(guild=True, user=True),
-        #     )
-        # )
 
     async def setup_hook(self):
-        await self.tree.sync()
+        # Syncing is heavily rate limited, so only do it when the commands (or the
+        # application they belong to) have actually changed since the last sync.
+        payload = json.dumps(
+            [self.application_id]
+            + [command.to_dict(self.tree) for command in self.tree.get_commands()],
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(payload.encode()).hexdigest()
+        try:
+            with open(SYNCED_HASH_PATH) as f:
+                synced_digest = f.read().strip()
+        except FileNotFoundError:
+            synced_digest = None
+        if digest != synced_digest:
+            await self.tree.sync()
+            with open(SYNCED_HASH_PATH, "w") as f:
+                f.write(digest)
+
+    async def on_member_update(self, before: Member, after: Member):
+        if before.roles != after.roles:
+            self.elegible_guilds_cache.invalidate(after.id)
+
+    async def on_member_remove(self, member: Member):
+        self.elegible_guilds_cache.invalidate(member.id)
+
+    async def on_member_ban(self, guild: Guild, user: User | Member):
+        self.elegible_guilds_cache.invalidate(user.id)
+
+    async def on_guild_join(self, guild: Guild):
+        self.elegible_guilds_cache.clear()
 
     def emojis_in_string(self, string: str):
+        state = self._get_state()
         return {
-            PartialEmoji.with_state(
-                self._get_state(),
-                id=int(match.group("id")),
-                name=match.group("name"),
-                animated=match.group("anim") is not None,
-            )
-            for match in EmojiCopier.EMOJI_REGEX.finditer(string)
+            PartialEmoji.with_state(state, id=int(id), name=name, animated=bool(anim))
+            for anim, name, id in EmojiCopier.EMOJI_REGEX.findall(string)
         }
 
     def reaction_emojis(self, message: Message):
@@ -513,14 +682,61 @@ class EmojiCopier(Client):
             and reaction.emoji.id is not None
         }
 
-    def elegible_guilds_for_user(self, user: User | Member):
+    def elegible_guilds_for_user(self, user: User | Member) -> list[Guild]:
+        # Only cache IDs so that guilds the bot or the user has since left drop
+        # out, and so that stale Guild objects aren't kept alive.
+        if (guild_ids := self.elegible_guilds_cache.get(user.id)) is not None:
+            return [
+                guild
+                for guild_id in guild_ids
+                if (guild := self.get_guild(guild_id)) is not None
+                and guild.get_member(user.id) is not None
+            ]
+        guilds = []
         for guild in user.mutual_guilds:
-            assert (member := guild.get_member(user.id)) is not None
-            if member.guild_permissions.create_expressions:
-                yield guild
+            member = guild.get_member(user.id)
+            if (
+                member is not None
+                and member.guild_permissions.value & CREATE_EXPRESSIONS_BIT
+            ):
+                guilds.append(guild)
+        self.elegible_guilds_cache.put(user.id, [guild.id for guild in guilds])
+        return guilds
+
+    async def cached_fetch_user(self, user_id: int) -> User:
+        if (user := self.user_cache.get(user_id)) is None:
+            user = await self.fetch_user(user_id)
+            self.user_cache.put(user_id, user)
+        return user
+
+    async def cached_fetch_guild_preview(self, guild_id: int) -> GuildPreview:
+        if (preview := self.guild_preview_cache.get(guild_id)) is None:
+            preview = await self.fetch_guild_preview(guild_id)
+            self.guild_preview_cache.put(guild_id, preview)
+        return preview
+
+    def format_emoji_line(self, emoji: Emoji | PartialEmoji):
+        return f"- {emoji} [{emoji.name}]({emoji.url})"
 
     def format_asset_link(self, asset: Asset):
-        return f"[{urlparse(asset.url).path.split("/")[-1]}]({asset.url})"
+        url = asset.url
+        return f"[{url.partition("?")[0].rpartition("/")[2]}]({url})"
+
+    def add_asset_fields(
+        self, embed: Embed, assets: list[tuple[str, Asset | str | None]]
+    ):
+        for name, asset in assets:
+            if asset is not None:
+                embed.add_field(
+                    name=name,
+                    value=(
+                        self.format_asset_link(asset)
+                        if isinstance(asset, Asset)
+                        else asset
+                    ),
+                    inline=False,
+                )
+        return embed
 
     async def install(self, interaction: Interaction):
         await interaction.response.send_message(
@@ -528,8 +744,13 @@ class EmojiCopier(Client):
         )
 
     async def check_password_strength(self, interaction: Interaction, message: Message):
-        results = zxcvbn(message.content)
-        await interaction.response.send_message(
+        await interaction.response.defer(thinking=True)
+        # zxcvbn loads several megabytes of word lists, so import it lazily.
+        from zxcvbn import zxcvbn
+
+        # Scoring long inputs can take hundreds of milliseconds of pure Python.
+        results = await asyncio.to_thread(zxcvbn, message.content)
+        await interaction.followup.send(
             embed=Embed(
                 color=password_strengths[results["score"]][1],
                 title=f"Password strength: {password_strengths[results["score"]][0]}",
@@ -558,10 +779,7 @@ class EmojiCopier(Client):
                     color=Color.brand_green(),
                     title=f"{len(body_emojis)} {"emojis" if len(body_emojis) != 1 else "emoji"} in message content",
                     description="\n".join(
-                        [
-                            f"- {str(emoji)} [{emoji.name}]({emoji.url})"
-                            for emoji in body_emojis
-                        ]
+                        [self.format_emoji_line(emoji) for emoji in body_emojis]
                     ),
                 )
             )
@@ -571,10 +789,7 @@ class EmojiCopier(Client):
                     color=Color.brand_green(),
                     title=f"{len(reaction_emojis)} {"reactions" if len(reaction_emojis) != 1 else "reaction"}",
                     description="\n".join(
-                        [
-                            f"- {str(emoji)} [{emoji.name}]({emoji.url})"
-                            for emoji in reaction_emojis
-                        ]
+                        [self.format_emoji_line(emoji) for emoji in reaction_emojis]
                     ),
                 )
             )
@@ -603,7 +818,8 @@ class EmojiCopier(Client):
             )
 
     async def extract_user_assets(self, interaction: Interaction, user: Member | User):
-        full_user = await self.fetch_user(user.id)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        full_user = await self.cached_fetch_user(user.id)
         embed = Embed(
             title=f"Assets of @{full_user.name} ({full_user.display_name})",
             color=full_user.accent_color,
@@ -619,37 +835,26 @@ class EmojiCopier(Client):
         embed.set_thumbnail(url=user.display_avatar.url)
         if full_user.accent_color is not None:
             embed.add_field(name="Color", value=full_user.accent_color)
-        if full_user.banner is not None:
-            embed.add_field(
-                name="Banner",
-                value=self.format_asset_link(full_user.banner),
-                inline=False,
-            )
-        if full_user.avatar_decoration is not None:
-            embed.add_field(
-                name="Avatar decoration",
-                value=self.format_asset_link(full_user.avatar_decoration),
-                inline=False,
-            )
+        self.add_asset_fields(
+            embed,
+            [
+                ("Banner", full_user.banner),
+                ("Avatar decoration", full_user.avatar_decoration),
+            ],
+        )
         if isinstance(user, Member):
-            if user.guild_avatar is not None and user.guild_avatar != user.avatar:
-                embed.add_field(
-                    name="Server avatar",
-                    value=self.format_asset_link(user.guild_avatar),
-                    inline=False,
-                )
-            if user.display_icon is not None:
-                embed.add_field(
-                    name="Role icon",
-                    value=(
-                        self.format_asset_link(user.display_icon)
-                        if isinstance(user.display_icon, Asset)
-                        else user.display_icon
+            self.add_asset_fields(
+                embed,
+                [
+                    (
+                        "Server avatar",
+                        user.guild_avatar if user.guild_avatar != user.avatar else None,
                     ),
-                    inline=False,
-                )
+                    ("Role icon", user.display_icon),
+                ],
+            )
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
 
     async def extract_server_assets(self, interaction: Interaction):
         guild = interaction.guild
@@ -664,7 +869,7 @@ class EmojiCopier(Client):
             return
         elif guild not in self.guilds:
             try:
-                guild = await self.fetch_guild_preview(guild.id)
+                guild = await self.cached_fetch_guild_preview(guild.id)
             except NotFound:
                 await interaction.response.send_message(
                     embed=Embed(
@@ -692,24 +897,14 @@ class EmojiCopier(Client):
             inline=False,
         )
         embed.set_thumbnail(url=guild.icon.url if guild.icon is not None else None)
-        if isinstance(guild, Guild) and guild.banner is not None:
-            embed.add_field(
-                name="Banner",
-                value=self.format_asset_link(guild.banner),
-                inline=False,
-            )
-        if guild.splash is not None:
-            embed.add_field(
-                name="Invite splash",
-                value=self.format_asset_link(guild.splash),
-                inline=False,
-            )
-        if guild.discovery_splash is not None:
-            embed.add_field(
-                name="Discovery splash",
-                value=self.format_asset_link(guild.discovery_splash),
-                inline=False,
-            )
+        self.add_asset_fields(
+            embed,
+            [
+                ("Banner", guild.banner if isinstance(guild, Guild) else None),
+                ("Invite splash", guild.splash),
+                ("Discovery splash", guild.discovery_splash),
+            ],
+        )
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
@@ -732,18 +927,18 @@ class EmojiCopier(Client):
     async def copy_expressions(self, interaction: Interaction, message: Message):
         body_emojis = self.emojis_in_string(message.content)
         reaction_emojis = self.reaction_emojis(message)
-        expressions: list[tuple[Expression, ExpressionLocation]] = list(
-            {(emoji, ExpressionLocation.MESSAGE) for emoji in body_emojis}
-            | {(emoji, ExpressionLocation.REACTION) for emoji in reaction_emojis}
-            | {
-                (sticker, ExpressionLocation.STICKER)
-                async for sticker in (
-                    await sticker.fetch() for sticker in message.stickers
+        expressions: dict[int, tuple[Expression, ExpressionLocation]] = {}
+        for emoji in body_emojis:
+            expressions.setdefault(emoji.id, (emoji, ExpressionLocation.MESSAGE))
+        for emoji in reaction_emojis:
+            expressions.setdefault(emoji.id, (emoji, ExpressionLocation.REACTION))
+        for sticker in message.stickers:
+            # discord.py can't download Lottie stickers, so they can't be copied.
+            if sticker.format != StickerFormatType.lottie:
+                expressions.setdefault(
+                    sticker.id, (sticker, ExpressionLocation.STICKER)
                 )
-                if isinstance(sticker, GuildSticker)
-            }
-        )
-        elegible_guilds = list(self.elegible_guilds_for_user(interaction.user))
+        elegible_guilds = self.elegible_guilds_for_user(interaction.user)
         if not len(expressions):
             await interaction.response.send_message(
                 embed=Embed(
@@ -790,7 +985,7 @@ class EmojiCopier(Client):
                 ephemeral=True,
             )
             return
-        elegible_guilds = list(self.elegible_guilds_for_user(interaction.user))
+        elegible_guilds = self.elegible_guilds_for_user(interaction.user)
         if len(elegible_guilds) == 0:
             await interaction.response.send_message(
                 embed=Embed(
@@ -837,14 +1032,14 @@ class EmojiCopier(Client):
                 ephemeral=True,
             )
         else:
-            expressions = [
-                (emoji, ExpressionLocation.MESSAGE)
+            expressions: dict[int, tuple[Expression, ExpressionLocation]] = {
+                emoji.id: (emoji, ExpressionLocation.MESSAGE)
                 for emoji in interaction.guild.emojis
-            ] + [
-                (sticker, ExpressionLocation.STICKER)
+            } | {
+                sticker.id: (sticker, ExpressionLocation.STICKER)
                 for sticker in interaction.guild.stickers
-            ]
-            elegible_guilds = list(self.elegible_guilds_for_user(interaction.user))
+            }
+            elegible_guilds = self.elegible_guilds_for_user(interaction.user)
             if not len(expressions):
                 await interaction.response.send_message(
                     embed=Embed(
@@ -884,6 +1079,8 @@ class EmojiCopier(Client):
 
 
 if __name__ == "__main__":
+    import tomllib
+
     with open("config.toml", "rb") as f:
         config = tomllib.load(f)
     EmojiCopier().run(config["token"])